@@ -1,16 +1,25 @@
+import io
 import os
-from datetime import datetime
-from typing import Optional
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 import firebase_admin
 import ujson as json
 from firebase_admin import firestore, storage as firebase_storage, credentials
 from google.api_core.datetime_helpers import DatetimeWithNanoseconds
-from google.api_core.exceptions import NotFound, AlreadyExists
+from google.api_core.exceptions import NotFound, AlreadyExists, GoogleAPICallError
 from google.cloud.firestore_v1.collection import CollectionReference
+from google.cloud.firestore_v1.document import DocumentSnapshot
+from google.cloud.storage import Blob
 
 from climatepixdb.core.errors import UploadError, CredentialsError
+from climatepixdb.core.image_header import parse_image_header
 from climatepixdb.core.image_info import ImageInfo
+from climatepixdb.core.image_table import ImageTable
+from climatepixdb.core.metadata_reader import find_metadata_files, iter_metadata
 from climatepixdb.core.sending_utils import Sending, UploadToSend
 from climatepixdb.core.upload_failure import UploadFailure
 from climatepixdb.core.upload_info import UploadInfo
@@ -24,6 +33,17 @@ class ClimatePixDatabase:
     """
     __slots__ = ('__database', '__storage', '__dev_collection', '__public_collection')
 
+    # Maximum number of operations in a Firestore write batch.
+    FIRESTORE_BATCH_SIZE = 500
+    # Number of blob deletions sent per storage batch request.
+    STORAGE_BATCH_SIZE = 100
+    # Number of first bytes read to find image dimensions. If dimensions are further
+    # (e.g. JPEG frame after big EXIF data), more bytes are read as requested by header parser,
+    # plus this number of bytes ahead.
+    PROBE_SIZE = 4096
+    # Size of ranged reads used to download images in memory.
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
     def __init__(self):
         credentials_file_name = "credentials.json"
         if not os.path.isfile(credentials_file_name):
@@ -42,6 +62,22 @@ class ClimatePixDatabase:
         for blob in self.__storage.list_blobs(prefix='dev/'):
             print(blob.name)
 
+    @staticmethod
+    def __stream(collection, before=None, after=None):
+        # type: (CollectionReference, Optional[DatetimeWithNanoseconds], Optional[DatetimeWithNanoseconds]) -> Iterator[DocumentSnapshot]
+        """ Stream documents from given collection. See `__get_uploads()` for parameters. """
+        if before is None and after is None:
+            return collection.stream()
+        if before is not None and after is not None:
+            raise AssertionError('after and before cannot be provided both.')
+        if after is not None:
+            comparison = '>'
+            timestamp = after
+        else:
+            comparison = '<'
+            timestamp = before
+        return collection.where('timestamp', comparison, timestamp).stream()
+
     @staticmethod
     def __get_uploads(collection, before=None, after=None):
         # type: (CollectionReference, Optional[DatetimeWithNanoseconds], Optional[DatetimeWithNanoseconds]) -> UploadList
@@ -58,24 +94,13 @@ class ClimatePixDatabase:
             :return: a list of UploadInfo objects.
         """
         upload_list = UploadList()
-        if before is None and after is None:
-            stream = collection.stream()
-        else:
-            if before is not None and after is not None:
-                raise AssertionError('after and before cannot be provided both.')
-            if after is not None:
-                comparison = '>'
-                timestamp = after
-            else:
-                comparison = '<'
-                timestamp = before
-            stream = collection.where('timestamp', comparison, timestamp).stream()
-        for doc in stream:
+        for doc in ClimatePixDatabase.__stream(collection, before, after):
             doc_dict = doc.to_dict()
             try:
-                upload_list.add_upload(UploadInfo(collection.id, doc.id, doc_dict))
+                upload_list.add_upload(UploadInfo(collection.id, doc.id, doc_dict, doc.create_time))
             except UploadError as exc:
-                upload_list.add_failure(UploadFailure(collection.id, doc.id, exc, doc_dict))
+                upload_list.add_failure(
+                    UploadFailure(collection.id, doc.id, exc, doc_dict, doc.create_time))
         return upload_list
 
     def get_dev_uploads(self, before=None, after=None):
@@ -96,13 +121,23 @@ class ClimatePixDatabase:
         """
         return self.__get_uploads(self.__public_collection, before=before, after=after)
 
+    def get_image_table(self, dev=False, before=None, after=None):
+        # type: (bool, Optional[DatetimeWithNanoseconds], Optional[DatetimeWithNanoseconds]) -> ImageTable
+        """ Retrieve images info from `dev` (if dev is True) or `public` database folder
+            as an ImageTable, built directly from documents stream.
+            See `get_dev_uploads()` for parameters before and after.
+        """
+        collection = self.__dev_collection if dev else self.__public_collection
+        return ImageTable.from_documents(self.__stream(collection, before=before, after=after))
+
     def download_all_images(self,
                             uploads,
                             output_folder,
                             categorize=False,
                             verbose=False,
-                            save_metadata=True):
-        # type: (UploadList, str, bool, bool, bool) -> int
+                            save_metadata=True,
+                            image_filter=None):
+        # type: (UploadList, str, bool, bool, bool, Optional[Callable[[ImageInfo], bool]]) -> int
         """ Download all images from given list of uploads to given output folder.
             If an image is successfully downloaded, field ImageInfo.local_path
             of corresponding ImageInfo object will be updated with local image path.
@@ -117,10 +152,16 @@ class ClimatePixDatabase:
                 - If `categorize` is True, save metadata for each category into `<output_folder>/<category>/metadata.json`.
                   JSON object will be a dictionary mapping each image file path to a dictionary of metadata
                   (location and timestamp).
+                If images were probed (see `probe_images()`), metadata also contains image format,
+                width, height and size.
+            :param image_filter: (optional) a function receiving an ImageInfo object and returning
+                True if image must be downloaded (e.g. `climatepixdb.core.others.min_resolution()`).
+                If provided, images without metadata are not downloaded.
             :return: number of images downloaded.
         """
         metadata = {}
         downloaded_images = set()
+        filtered_images = set()
         images_without_metadata = set()
         upload_indices = set()
         for collection_id in uploads.collections:
@@ -131,9 +172,15 @@ class ClimatePixDatabase:
                 if upload_id in uploads.uploads and blob.name in uploads.uploads[upload_id].images:
                     upload_info = uploads.uploads[upload_id]
                     image_info = upload_info.images[blob.name]
+                    if image_filter is not None and not image_filter(image_info):
+                        filtered_images.add(blob.name)
+                        continue
                     category = image_info.category
                     location = image_info.location
                     timestamp = str(upload_info.timestamp)
+                elif image_filter is not None:
+                    images_without_metadata.add(blob.name)
+                    continue
                 else:
                     images_without_metadata.add(blob.name)
                     category = ImageInfo.UNKNOWN_CATEGORY
@@ -156,16 +203,18 @@ class ClimatePixDatabase:
                         image_info.local_path = output_path
                     if save_metadata:
                         if categorize:
-                            metadata.setdefault(category, {})[output_path] = {
+                            image_metadata = metadata.setdefault(category, {})[output_path] = {
                                 'location': location,
                                 'timestamp': timestamp
                             }
                         else:
-                            metadata[output_path] = {
+                            image_metadata = metadata[output_path] = {
                                 'category': category,
                                 'location': location,
                                 'timestamp': timestamp
                             }
+                        if image_info:
+                            image_metadata.update(image_info.get_header_metadata())
                     if verbose:
                         print('DOWNLOADED', blob.name, '=>', output_path)
 
@@ -176,7 +225,7 @@ class ClimatePixDatabase:
                 invalid_uploads.append(upload)
             else:
                 for firebase_path in upload.images:
-                    if firebase_path not in downloaded_images:
+                    if firebase_path not in downloaded_images and firebase_path not in filtered_images:
                         remaining_images.add(firebase_path)
         for failure in uploads.failures.values():
             if failure.upload_id not in upload_indices:
@@ -186,6 +235,8 @@ class ClimatePixDatabase:
                 print('NOT FOUND', firebase_path)
             if downloaded_images:
                 print('NB DOWNLOADED', len(downloaded_images))
+            if filtered_images:
+                print('NB FILTERED', len(filtered_images))
             if images_without_metadata:
                 print('NB WITHOUT METADATA', len(images_without_metadata))
             for upload_status in sorted(invalid_uploads, key=lambda u: u.upload_id):
@@ -207,6 +258,147 @@ class ClimatePixDatabase:
                     print('METADATA SAVED', json_path)
         return len(downloaded_images)
 
+    def __list_image_blobs(self, uploads):
+        # type: (UploadList) -> Iterator[Tuple[ImageInfo, Blob]]
+        """ Lazily generate couples (ImageInfo, storage blob) for all images
+            from given uploads found in storage.
+        """
+        for collection_id in uploads.collections:
+            for blob in self.__storage.list_blobs(prefix='%s/' % collection_id):
+                upload_id = blob.name.split('/')[1]
+                if upload_id in uploads.uploads and blob.name in uploads.uploads[upload_id].images:
+                    yield uploads.uploads[upload_id].images[blob.name], blob
+
+    def iter_images(self,
+                    uploads,
+                    as_file=False,
+                    max_workers=8,
+                    max_items=32,
+                    max_bytes=64 * 1024 * 1024,
+                    verbose=False):
+        # type: (UploadList, bool, int, int, int, bool) -> Iterator[Tuple[ImageInfo, Union[bytes, BinaryIO]]]
+        """ Generate images from given list of uploads directly in memory, without writing on disk.
+            Images are downloaded concurrently into a bounded prefetch buffer, and yielded
+            in storage listing order. Images are downloaded by chunks (see DOWNLOAD_CHUNK_SIZE).
+            If generator is closed before end (e.g. consumer breaks from loop), downloads
+            not yet started are cancelled, and running downloads stop after their current chunk.
+            :param uploads: a UploadList object.
+            :param as_file: if True, yield images as file-like objects (io.BytesIO)
+                instead of bytes.
+            :param max_workers: number of concurrent downloads.
+            :param max_items: maximum number of images downloading or waiting to be consumed.
+            :param max_bytes: maximum total size in bytes of images downloading or waiting
+                to be consumed. At least one image is always prefetched, even if bigger.
+            :param verbose: if True, print images not found.
+            :return: a generator of couples (ImageInfo, image bytes or file-like object).
+        """
+        to_fetch = self.__list_image_blobs(uploads)
+        next_image = next(to_fetch, None)
+        pending = deque()
+        pending_bytes = 0
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while pending or next_image is not None:
+                while next_image is not None and (
+                        not pending
+                        or (len(pending) < max_items
+                            and pending_bytes + (next_image[1].size or 0) <= max_bytes)):
+                    image_info, blob = next_image
+                    size = blob.size or 0
+                    pending.append((image_info, size, executor.submit(self.__download_bytes, blob, cancelled)))
+                    pending_bytes += size
+                    next_image = next(to_fetch, None)
+                image_info, size, future = pending.popleft()
+                pending_bytes -= size
+                try:
+                    data = future.result()
+                except NotFound:
+                    if verbose:
+                        print('NOT FOUND', image_info.firebase_path)
+                    continue
+                yield image_info, (io.BytesIO(data) if as_file else data)
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __download_bytes(self, blob, cancelled):
+        # type: (Blob, threading.Event) -> Optional[bytes]
+        """ Download blob content by chunks. Return None if download is cancelled. """
+        if not blob.size:
+            return blob.download_as_bytes()
+        chunks = []
+        for start in range(0, blob.size, self.DOWNLOAD_CHUNK_SIZE):
+            if cancelled.is_set():
+                return None
+            end = min(start + self.DOWNLOAD_CHUNK_SIZE, blob.size) - 1
+            chunks.append(blob.download_as_bytes(start=start, end=end))
+        return b''.join(chunks)
+
+    def probe_images(self, uploads, max_workers=16, verbose=False):
+        # type: (UploadList, int, bool) -> int
+        """ Retrieve format, dimensions and size of all images from given list of uploads,
+            without downloading full images. Only first bytes of each image are downloaded
+            (see PROBE_SIZE) and parsed (see `climatepixdb.core.image_header`).
+            Fields ImageInfo.format, width, height and size of corresponding ImageInfo objects
+            will be updated for each image successfully probed.
+            :param uploads: a UploadList object.
+            :param max_workers: number of concurrent probes.
+            :param verbose: if True, print info about each image probed.
+            :return: number of images probed.
+        """
+        nb_probed = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for image_info, blob in self.__list_image_blobs(uploads):
+                if len(pending) >= 4 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    nb_probed += sum(future.result() for future in done)
+                pending.add(executor.submit(self.__probe_image, image_info, blob, verbose))
+            nb_probed += sum(future.result() for future in pending)
+        if verbose:
+            print('NB PROBED', nb_probed)
+        return nb_probed
+
+    def __probe_image(self, image_info, blob, verbose):
+        # type: (ImageInfo, Blob, bool) -> bool
+        if blob.size == 0:
+            if verbose:
+                print('UNKNOWN FORMAT', blob.name, '(empty image)')
+            return False
+        data = b''
+        needed = self.PROBE_SIZE
+        while True:
+            # Read ahead, so that next few headers (e.g. JPEG segments) are likely read at once.
+            end = max(needed, len(data) + self.PROBE_SIZE)
+            if blob.size is not None:
+                end = min(end, blob.size)
+            try:
+                chunk = blob.download_as_bytes(start=len(data), end=end - 1)
+            except NotFound:
+                if verbose:
+                    print('NOT FOUND', blob.name)
+                return False
+            except GoogleAPICallError as exc:
+                print('CANNOT PROBE', blob.name, exc)
+                return False
+            if not chunk:
+                break
+            data += chunk
+            parsed, needed = parse_image_header(data)
+            if parsed is not None:
+                image_info.format, image_info.width, image_info.height = parsed
+                image_info.size = blob.size
+                if verbose:
+                    print('PROBED', blob.name, '%s %dx%d' % parsed)
+                return True
+            # Stop if format is unknown, or if whole image was read.
+            if needed <= len(data) or (blob.size is not None and len(data) >= blob.size):
+                break
+        if verbose:
+            print('UNKNOWN FORMAT', blob.name)
+        return False
+
     def delete_invalid_documents(self, uploads):
         # type: (UploadList) -> None
         upload_indices = {}
@@ -228,6 +420,94 @@ class ClimatePixDatabase:
                   '%s/%s' % (collection_id, upload_id),
                   '(no images associated)')
 
+    def find_orphans(self, uploads, collection_id, min_age=None):
+        # type: (UploadList, str, Optional[timedelta]) -> Tuple[List[Tuple[str, str]], List[str]]
+        """ Compare database documents and storage blobs in a single pass over blob listing.
+            Given uploads should be retrieved without date filter, otherwise blobs from
+            uploads outside of date range will be reported as orphans.
+            :param uploads: a UploadList object.
+            :param collection_id: collection to check (e.g. "dev" or "public"). Blobs are listed
+                from this collection folder even if given uploads contain no document from it.
+            :param min_age: (optional) a timedelta. If provided, documents and blobs created
+                more recently are ignored, as they may belong to an upload still in progress.
+                Documents with unknown creation time are then ignored too.
+            :return: a couple (invalid_documents, orphan_blobs):
+                - invalid_documents: sorted list of (collection_id, upload_id) for documents
+                  not associated to any blob.
+                - orphan_blobs: sorted list of blob names either not associated to any document,
+                  or not listed in images of associated document. Blobs associated to an invalid
+                  document (UploadFailure) are not considered orphans, as document images are unknown.
+        """
+        limit = None if min_age is None else datetime.now(timezone.utc) - min_age
+        blob_upload_ids = set()
+        orphan_blobs = []
+        for blob in self.__storage.list_blobs(prefix='%s/' % collection_id):
+            upload_id = blob.name.split('/')[1]
+            blob_upload_ids.add(upload_id)
+            if limit is not None and blob.time_created > limit:
+                continue
+            upload = uploads.uploads.get(upload_id, None)
+            failure = uploads.failures.get(upload_id, None)
+            if upload is not None and upload.collection_id == collection_id:
+                if blob.name not in upload.images:
+                    orphan_blobs.append(blob.name)
+            elif failure is None or failure.collection_id != collection_id:
+                orphan_blobs.append(blob.name)
+        invalid_documents = []
+        for upload in list(uploads.uploads.values()) + list(uploads.failures.values()):
+            if (upload.collection_id == collection_id
+                    and upload.upload_id not in blob_upload_ids
+                    and (limit is None
+                         or (upload.create_time is not None and upload.create_time <= limit))):
+                invalid_documents.append((upload.collection_id, upload.upload_id))
+        invalid_documents.sort()
+        orphan_blobs.sort()
+        return invalid_documents, orphan_blobs
+
+    def reconcile(self, uploads, collection_id, min_age=None, dry_run=False, verbose=False):
+        # type: (UploadList, str, Optional[timedelta], bool, bool) -> Tuple[int, int]
+        """ Delete both documents without blobs and blobs without documents (see `find_orphans()`).
+            Deletions are sent in batches.
+            :param uploads: a UploadList object, retrieved without date filter.
+            :param collection_id: collection to clean (e.g. "dev" or "public").
+            :param min_age: (optional) a timedelta. If provided, documents and blobs created
+                more recently are not deleted (see `find_orphans()`).
+            :param dry_run: if True, only report orphans without deleting anything.
+            :param verbose: if True, print each orphan found.
+            :return: a couple (number of invalid documents, number of orphan blobs).
+        """
+        invalid_documents, orphan_blobs = self.find_orphans(uploads, collection_id, min_age)
+        if verbose:
+            for doc_collection_id, upload_id in invalid_documents:
+                print('INVALID UPLOAD ENTRY', '%s/%s' % (doc_collection_id, upload_id),
+                      '(no images associated)')
+            for blob_name in orphan_blobs:
+                print('ORPHAN IMAGE', blob_name, '(no metadata associated)')
+        print('NB INVALID UPLOAD ENTRIES', len(invalid_documents))
+        print('NB ORPHAN IMAGES', len(orphan_blobs))
+        if dry_run:
+            return len(invalid_documents), len(orphan_blobs)
+
+        for i in range(0, len(invalid_documents), self.FIRESTORE_BATCH_SIZE):
+            batch = self.__database.batch()
+            chunk = invalid_documents[i:(i + self.FIRESTORE_BATCH_SIZE)]
+            for doc_collection_id, upload_id in chunk:
+                batch.delete(self.__database.collection(doc_collection_id).document(upload_id))
+            batch.commit()
+            print('DELETED INVALID UPLOAD ENTRIES', i + len(chunk), '/', len(invalid_documents))
+
+        for i in range(0, len(orphan_blobs), self.STORAGE_BATCH_SIZE):
+            chunk = orphan_blobs[i:(i + self.STORAGE_BATCH_SIZE)]
+            try:
+                with self.__storage.client.batch():
+                    for blob_name in chunk:
+                        self.__storage.delete_blob(blob_name)
+            except NotFound as exc:
+                # Some blobs of this batch were already deleted.
+                print('[IMAGE NOT FOUND]', exc)
+            print('DELETED ORPHAN IMAGES', i + len(chunk), '/', len(orphan_blobs))
+        return len(invalid_documents), len(orphan_blobs)
+
     def delete_uploads(self, uploads, force=False, verbose=False):
         # type: (UploadList, bool, bool) -> None
         """ Delete all images from given list of uploads on server.
@@ -270,19 +550,83 @@ class ClimatePixDatabase:
             if verbose:
                 print('[DOC DELETED]', doc.id)
 
-    def upload(self, metadata_file_name):
-        # type: (str) -> None
-        metadata_file_name = os.path.abspath(metadata_file_name)
+    def upload(self, paths, max_workers=4):
+        # type: (Union[str, Sequence[str]], int) -> int
+        """ Upload images and metadata previously downloaded with `download_all_images()`.
+            Metadata files are read incrementally twice:
+            - first pass checks metadata and counts images per upload. Only one compact entry
+              (timestamp and number of images) is kept in memory per upload.
+            - second pass groups images per upload, and sends each upload into a single
+              bounded transfer queue as soon as all its images are read. So, only uploads
+              not yet complete are kept in memory (e.g. uploads spread across many category folders).
+            If an upload cannot be sent, it is reported, images and document already sent
+            for this upload are deleted, and other uploads are still sent.
+            :param paths: a path or a list of paths. Each path is either a metadata file
+                (see `climatepixdb.core.metadata_reader.iter_metadata()`), or a directory
+                to recursively search for metadata files (e.g. output folder of a categorized download).
+            :param max_workers: number of uploads sent concurrently.
+            :return: number of uploads sent.
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        metadata_file_names = find_metadata_files(paths)
+        if not metadata_file_names:
+            raise RuntimeError('No metadata file found in %s' % ', '.join(paths))
+
+        # Check metadata and count images per upload.
+        upload_sizes = {}  # type: Dict[Tuple[str, str], List]
+        for metadata_file_name in metadata_file_names:
+            print('READING METADATA', metadata_file_name)
+            for sending in self.__iter_sendings(metadata_file_name, verbose=True):
+                key = (sending.collection_id, sending.upload_id)
+                if key not in upload_sizes:
+                    upload_sizes[key] = [sending.timestamp, 1]
+                elif upload_sizes[key][0] != sending.timestamp:
+                    raise RuntimeError('No same timestamp for all images in %s' % sending.upload_id)
+                else:
+                    upload_sizes[key][1] += 1
+
+        # Send each upload as soon as all its images are read.
+        incomplete_uploads = {}  # type: Dict[Tuple[str, str], UploadToSend]
+        futures = set()
+        nb_sent = 0
+        nb_failed = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for metadata_file_name in metadata_file_names:
+                for sending in self.__iter_sendings(metadata_file_name):
+                    key = (sending.collection_id, sending.upload_id)
+                    if key not in incomplete_uploads:
+                        incomplete_uploads[key] = UploadToSend(
+                            sending.collection_id, sending.upload_id, sending.timestamp, [])
+                    upload = incomplete_uploads[key]
+                    upload.images.append(sending)
+                    if len(upload.images) == upload_sizes[key][1]:
+                        del incomplete_uploads[key]
+                        if len(futures) >= 2 * max_workers:
+                            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                            nb_done = sum(future.result() for future in done)
+                            nb_sent += nb_done
+                            nb_failed += len(done) - nb_done
+                        futures.add(executor.submit(self.__send_upload, upload))
+            nb_done = sum(future.result() for future in futures)
+            nb_sent += nb_done
+            nb_failed += len(futures) - nb_done
+        for upload in incomplete_uploads.values():
+            print('CANNOT SEND UPLOAD', upload.upload_id, '(metadata changed while reading)')
+            nb_failed += 1
+        print('NB UPLOADS SENT', nb_sent)
+        if nb_failed:
+            print('NB UPLOADS NOT SENT', nb_failed)
+        return nb_sent
+
+    @staticmethod
+    def __iter_sendings(metadata_file_name, verbose=False):
+        # type: (str, bool) -> Iterator[Sending]
+        """ Generate images to send from given metadata file, with category checked and set. """
         metadata_directory = os.path.dirname(metadata_file_name)
-        with open(metadata_file_name, 'r') as file:
-            metadata = json.load(file)
-        if not isinstance(metadata, dict):
-            raise RuntimeError('Metadata is not a dictionary in file %s' % metadata_file_name)
-        structured_to_send = {}
-        uploads_to_send = {}
-        nb_no_category = 0
-        nb_sendings = 0
-        for image_path, image_metadata in sorted(metadata.items()):
+        inferred_category = None
+        has_category = None
+        for image_path, image_metadata in iter_metadata(metadata_file_name):
             image_basename = os.path.basename(image_path)
             sending = Sending()
             sending.category = image_metadata.get('category', None)
@@ -293,63 +637,66 @@ class ClimatePixDatabase:
             sending.image_id = int(os.path.splitext(image_name)[0])
             sending.local_path = os.path.join(metadata_directory, image_basename)
             assert sending.timestamp, 'Got an invalid timestamp'
-            nb_no_category += sending.category is None
-            nb_sendings += 1
-            structured_to_send.setdefault(
-                sending.collection_id, {}).setdefault(sending.upload_id, []).append(sending)
-
-        # Check categories.
-        if nb_no_category == nb_sendings:
-            inferred_category = os.path.basename(metadata_directory)
-            print('Getting category from metadata containing folder', inferred_category)
-            for upload_id_to_sendings in structured_to_send.values():
-                for sendings in upload_id_to_sendings.values():
-                    for sending in sendings:
-                        sending.category = inferred_category
-        elif nb_no_category != 0:
-            raise RuntimeError('Invalid metadata: all images should either have a category or '
-                               'no category specified (to be retrieved from metadata folder name).')
-
-        # Check timestamps.
-        for collection_id, uploads in structured_to_send.items():
-            for upload_id, images in uploads.items():
-                timestamps = {sending.timestamp for sending in images}
-                if len(timestamps) != 1:
-                    raise RuntimeError('No same timestamp for all images in %s' % upload_id)
-                timestamp = images[0].timestamp
-                # Update timestamp to current date if timestamp is unknown
-                if timestamp == ImageInfo.UNKNOWN_CATEGORY:
-                    timestamp = datetime.now().isoformat()
-                uploads_to_send.setdefault(collection_id, []).append(UploadToSend(
-                    upload_id, timestamp, images))
-
-        for collection_id, uploads in uploads_to_send.items():
-            col = self.__database.collection(collection_id)
-            for upload in sorted(uploads, key=lambda u: u.upload_id):
-                doc = col.document(upload.upload_id)
-                doc_just_created = False
+
+            # Check categories: first image of file tells if all images should have a category.
+            if has_category is None:
+                has_category = sending.category is not None
+                if not has_category:
+                    inferred_category = os.path.basename(metadata_directory)
+                    if verbose:
+                        print('Getting category from metadata containing folder', inferred_category)
+            elif has_category != (sending.category is not None):
+                raise RuntimeError('Invalid metadata in %s: all images should either have a category '
+                                   'or no category specified (to be retrieved from metadata folder name).'
+                                   % metadata_file_name)
+            if not has_category:
+                sending.category = inferred_category
+            yield sending
+
+    def __send_upload(self, upload):
+        # type: (UploadToSend) -> bool
+        """ Send an upload. On failure, print error and delete what was already sent.
+            Return True if upload was sent.
+        """
+        # Update timestamp to current date if timestamp is unknown
+        timestamp = upload.timestamp
+        if timestamp == ImageInfo.UNKNOWN_CATEGORY:
+            timestamp = datetime.now().isoformat()
+        doc = self.__database.collection(upload.collection_id).document(upload.upload_id)
+        doc_just_created = False
+        uploaded_blobs = []
+        try:
+            if len({sending.firebase_path for sending in upload.images}) != len(upload.images):
+                raise RuntimeError('Same image found many times in metadata')
+            doc.create({
+                'timestamp': datetime.fromisoformat(timestamp),
+                'images': None
+            })
+            doc_just_created = True
+            for sending in upload.images:  # type: Sending
+                blob = self.__storage.blob(sending.firebase_path)
+                if blob.exists():
+                    raise AlreadyExists(
+                        'An image already exists: %s' % sending.firebase_path)
+            for sending in sorted(upload.images, key=lambda s: s.image_id):  # type: Sending
+                blob = self.__storage.blob(sending.firebase_path)
+                blob.upload_from_filename(sending.local_path)
+                uploaded_blobs.append(blob)
+                sending.url = blob.public_url
+                print('UPLOADED', sending.firebase_path)
+            doc.update({
+                'images': [sending.to_upload() for sending in sorted(
+                    upload.images, key=lambda s: s.image_id)]
+            })
+            print('CREATED UPLOAD', upload.upload_id)
+            return True
+        except Exception as exc:
+            print('CANNOT SEND UPLOAD', upload.upload_id, '%s: %s' % (type(exc).__name__, exc))
+            for blob in uploaded_blobs:
                 try:
-                    doc.create({
-                        'timestamp': datetime.fromisoformat(upload.timestamp),
-                        'images': None
-                    })
-                    doc_just_created = True
-                    for sending in upload.images:  # type: Sending
-                        blob = self.__storage.blob(sending.firebase_path)
-                        if blob.exists():
-                            raise AlreadyExists(
-                                'An image already exists: %s' % sending.firebase_path)
-                    for sending in sorted(upload.images, key=lambda s: s.image_id):  # type: Sending
-                        blob = self.__storage.blob(sending.firebase_path)
-                        blob.upload_from_filename(sending.local_path)
-                        sending.url = blob.public_url
-                        print('UPLOADED', sending.firebase_path)
-                    doc.update({
-                        'images': [sending.to_upload() for sending in sorted(
-                            upload.images, key=lambda s: s.image_id)]
-                    })
-                    print('CREATED UPLOAD', upload.upload_id)
-                except AlreadyExists as exc:
-                    print('CANNOT SEND UPLOAD', upload.upload_id, exc)
-                    if doc_just_created:
-                        doc.delete()
+                    blob.delete()
+                except NotFound:
+                    pass
+            if doc_just_created:
+                doc.delete()
+            return False
@@ -0,0 +1,219 @@
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1'}
+# JPEG start-of-frame markers (0xC4, 0xC8 and 0xCC are not frames).
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Maximum size of an ISO BMFF box header (with 64-bit size).
+BOX_HEADER_SIZE = 16
+
+# Private parsers return either dimensions as (width, height), or an integer telling how many
+# first bytes of file are needed to go further, or None if data is invalid.
+ParseResult = Union[Tuple[int, int], int, None]
+
+
+def _parse_png(data):
+    # type: (bytes) -> ParseResult
+    if len(data) < 24:
+        return 24
+    if data[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', data[16:24])
+
+
+def _parse_jpeg(data):
+    # type: (bytes) -> ParseResult
+    i = 2
+    while True:
+        if i + 9 > len(data):
+            # Enough to read next marker, segment length, and frame dimensions if marker is a frame.
+            return i + 9
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte.
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers, without length.
+            i += 2
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', data[(i + 5):(i + 9)])
+            return width, height
+        i += 2 + struct.unpack('>H', data[(i + 2):(i + 4)])[0]
+
+
+def _parse_webp(data):
+    # type: (bytes) -> ParseResult
+    if len(data) < 30:
+        return 30
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and data[20] == 0x2F:
+        bits = struct.unpack('<I', data[21:25])[0]
+        return 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+    if chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height
+    return None
+
+
+def _find_box(data, start, end, box_type):
+    # type: (bytes, int, Optional[int], bytes) -> Union[Tuple[int, int], int, None]
+    """ Find an ISO BMFF box in data[start:end] (end None means until end of file).
+        :return: (payload start, box end) if box is found, or number of first bytes needed
+            to read next box header if data is truncated before box is found,
+            or None if box is not in given range.
+    """
+    while end is None or start + 8 <= end:
+        if start + BOX_HEADER_SIZE > len(data):
+            return start + BOX_HEADER_SIZE
+        size, found_type = struct.unpack('>I4s', data[start:(start + 8)])
+        payload_start = start + 8
+        if size == 1:
+            size = struct.unpack('>Q', data[(start + 8):(start + 16)])[0]
+            payload_start = start + 16
+        elif size == 0:
+            if end is None:
+                # Box extends to end of file.
+                return (payload_start, len(data)) if found_type == box_type else None
+            size = end - start
+        if size < payload_start - start:
+            return None
+        if found_type == box_type:
+            return payload_start, start + size
+        start += size
+    return None
+
+
+def _iter_boxes(data, start, end):
+    # type: (bytes, int, int) -> Iterator[Tuple[bytes, int, int]]
+    """ Generate ISO BMFF boxes contained in data[start:end] as couples (type, payload start, box end). """
+    while start + 8 <= end:
+        size, box_type = struct.unpack('>I4s', data[start:(start + 8)])
+        payload_start = start + 8
+        if size == 1:
+            size = struct.unpack('>Q', data[(start + 8):(start + 16)])[0]
+            payload_start = start + 16
+        elif size == 0:
+            size = end - start
+        if size < payload_start - start or start + size > end:
+            return
+        yield box_type, payload_start, start + size
+        start += size
+
+
+def _parse_primary_item_id(data, start):
+    # type: (bytes, int) -> int
+    version = data[start]
+    if version == 0:
+        return struct.unpack('>H', data[(start + 4):(start + 6)])[0]
+    return struct.unpack('>I', data[(start + 4):(start + 8)])[0]
+
+
+def _parse_item_properties(data, start):
+    # type: (bytes, int) -> Dict[int, List[int]]
+    """ Parse an ipma box: map each item ID to its 1-based property indices in ipco box. """
+    version = data[start]
+    large_indices = data[start + 3] & 1
+    position = start + 4
+    entry_count = struct.unpack('>I', data[position:(position + 4)])[0]
+    position += 4
+    associations = {}
+    for _ in range(entry_count):
+        if version < 1:
+            item_id = struct.unpack('>H', data[position:(position + 2)])[0]
+            position += 2
+        else:
+            item_id = struct.unpack('>I', data[position:(position + 4)])[0]
+            position += 4
+        association_count = data[position]
+        position += 1
+        indices = associations.setdefault(item_id, [])
+        for _ in range(association_count):
+            if large_indices:
+                indices.append(struct.unpack('>H', data[position:(position + 2)])[0] & 0x7FFF)
+                position += 2
+            else:
+                indices.append(data[position] & 0x7F)
+                position += 1
+    return associations
+
+
+def _parse_heif(data):
+    # type: (bytes) -> ParseResult
+    # Whole meta box is needed, as it contains primary item ID (pitm), item properties (iprp/ipco)
+    # including image spatial extents (ispe), and item properties associations (iprp/ipma).
+    box = _find_box(data, 0, None, b'meta')
+    if not isinstance(box, tuple):
+        return box
+    meta_start, meta_end = box
+    if meta_end > len(data):
+        return meta_end
+    primary_item_id = None
+    properties = []
+    associations = {}
+    # meta is a full box: skip version and flags.
+    for box_type, payload_start, box_end in _iter_boxes(data, meta_start + 4, meta_end):
+        if box_type == b'pitm':
+            primary_item_id = _parse_primary_item_id(data, payload_start)
+        elif box_type == b'iprp':
+            for child_type, child_start, child_end in _iter_boxes(data, payload_start, box_end):
+                if child_type == b'ipco':
+                    properties = list(_iter_boxes(data, child_start, child_end))
+                elif child_type == b'ipma':
+                    associations.update(_parse_item_properties(data, child_start))
+    extents = {}
+    for index, (box_type, payload_start, _) in enumerate(properties, start=1):
+        if box_type == b'ispe':
+            extents[index] = struct.unpack('>II', data[(payload_start + 4):(payload_start + 12)])
+    if primary_item_id is not None:
+        for index in associations.get(primary_item_id, ()):
+            if index in extents:
+                return extents[index]
+    # No primary item extents found: keep biggest image.
+    if extents:
+        return max(extents.values(), key=lambda dimensions: dimensions[0] * dimensions[1])
+    return None
+
+
+def parse_image_header(data):
+    # type: (bytes) -> Tuple[Optional[Tuple[str, int, int]], int]
+    """ Parse format and dimensions from first bytes of an image file.
+        Supported formats are JPEG, PNG, WebP and HEIF (HEIC).
+        :param data: first bytes of image file.
+        :return: a couple (header, needed):
+            - header: a tuple (format, width, height), with format in ('jpeg', 'png', 'webp', 'heic'),
+              or None if format is not supported or data is too short to find dimensions.
+            - needed: if header is None and data is too short, number of first bytes of file
+              needed to go further (dimensions may need many reads to be found).
+              Otherwise, 0.
+    """
+    if len(data) < 12:
+        return None, 12
+    if data.startswith(PNG_SIGNATURE):
+        parser, image_format = _parse_png, 'png'
+    elif data.startswith(b'\xff\xd8'):
+        parser, image_format = _parse_jpeg, 'jpeg'
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        parser, image_format = _parse_webp, 'webp'
+    elif data[4:8] == b'ftyp' and data[8:12] in HEIF_BRANDS:
+        parser, image_format = _parse_heif, 'heic'
+    else:
+        return None, 0
+    try:
+        result = parser(data)
+    except (struct.error, IndexError):
+        # Corrupted header.
+        return None, 0
+    if result is None:
+        return None, 0
+    if isinstance(result, int):
+        return None, result
+    return (image_format,) + tuple(result), 0
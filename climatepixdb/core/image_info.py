@@ -8,8 +8,11 @@ class ImageInfo:
             to set it manually to remember where you downloaded the image.
             If you use download memthods from class ClimatePixDatabase (`download_image() or download_all_images()`),
             this field will be automatically filled.
+        - format, width, height, size: image format ('jpeg', 'png', 'webp' or 'heic'), dimensions
+            and file size in bytes. Initialized with None, filled by `ClimatePixDatabase.probe_images()`.
     """
-    __slots__ = ('category', 'location', 'firebase_path', 'local_path', 'url')
+    __slots__ = ('category', 'location', 'firebase_path', 'local_path', 'url',
+                 'format', 'width', 'height', 'size')
 
     DEFAULT_CATEGORY = 'Flood'
     UNKNOWN_CATEGORY = '__unknown__'
@@ -20,3 +23,21 @@ class ImageInfo:
         self.firebase_path = dictionary['path']
         self.url = dictionary['url']
         self.local_path = local_path
+        self.format = None
+        self.width = None
+        self.height = None
+        self.size = None
+
+    def get_header_metadata(self):
+        # type: () -> dict
+        """ Return image format, dimensions and size as a dictionary, or an empty dictionary
+            if image was not probed.
+        """
+        if self.format is None:
+            return {}
+        return {
+            'format': self.format,
+            'width': self.width,
+            'height': self.height,
+            'size': self.size
+        }
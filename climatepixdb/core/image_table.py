@@ -0,0 +1,143 @@
+import calendar
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1.document import DocumentSnapshot
+
+from climatepixdb.core.image_info import ImageInfo
+
+NANOSECONDS_PER_DAY = 24 * 3600 * 1000000000
+
+
+class ImageTable:
+    """ Column-oriented table of images, to compute collection statistics quickly. Properties:
+        - timestamps: numpy array of upload timestamps in nanoseconds (one entry per image).
+        - categories: numpy array of category codes (one entry per image).
+        - locations: numpy array of location codes (one entry per image).
+        - category_names: list of categories names, indexed by category code.
+        - location_names: list of locations names, indexed by location code.
+    """
+    __slots__ = ('timestamps', 'categories', 'locations', 'category_names', 'location_names')
+
+    def __init__(self, timestamps, categories, locations, category_names, location_names):
+        # type: (np.ndarray, np.ndarray, np.ndarray, List[str], List[str]) -> None
+        self.timestamps = timestamps
+        self.categories = categories
+        self.locations = locations
+        self.category_names = category_names
+        self.location_names = location_names
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @classmethod
+    def from_documents(cls, documents):
+        # type: (Iterable[DocumentSnapshot]) -> ImageTable
+        """ Create an image table directly from a stream of upload documents, without creating
+            UploadInfo and ImageInfo objects. Invalid documents (see UploadInfo) are ignored.
+        """
+        category_codes = {}  # type: Dict[str, int]
+        location_codes = {}  # type: Dict[str, int]
+        timestamps = array('q')
+        categories = array('i')
+        locations = array('i')
+        for doc in documents:
+            doc_dict = doc.to_dict()
+            timestamp = doc_dict.get('timestamp', None)
+            images = doc_dict.get('images', None)
+            if not isinstance(timestamp, DatetimeWithNanoseconds) or not isinstance(images, list):
+                continue
+            timestamp = timestamp.timestamp_pb()
+            timestamp = timestamp.seconds * 1000000000 + timestamp.nanos
+            for image in images:
+                timestamps.append(timestamp)
+                categories.append(category_codes.setdefault(
+                    image['category'] or ImageInfo.DEFAULT_CATEGORY, len(category_codes)))
+                locations.append(location_codes.setdefault(image['location'], len(location_codes)))
+        return cls(np.frombuffer(timestamps, dtype=np.int64),
+                   np.frombuffer(categories, dtype=np.int32),
+                   np.frombuffer(locations, dtype=np.int32),
+                   list(category_codes),
+                   list(location_codes))
+
+    @classmethod
+    def load(cls, file_name):
+        # type: (str) -> ImageTable
+        """ Load an image table from a snapshot file saved with `save()`. """
+        with np.load(file_name) as data:
+            return cls(data['timestamps'],
+                       data['categories'],
+                       data['locations'],
+                       data['category_names'].tolist(),
+                       data['location_names'].tolist())
+
+    def save(self, file_name):
+        # type: (str) -> None
+        """ Save image table into a snapshot file (numpy .npz format). """
+        with open(file_name, 'wb') as file:
+            np.savez_compressed(file,
+                                timestamps=self.timestamps,
+                                categories=self.categories,
+                                locations=self.locations,
+                                category_names=np.array(self.category_names, dtype=str),
+                                location_names=np.array(self.location_names, dtype=str))
+
+    def select(self, before=None, after=None):
+        # type: (Optional[int], Optional[int]) -> ImageTable
+        """ Return a new image table with only images uploaded strictly before and/or after
+            given timestamps (in nanoseconds).
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if before is not None:
+            mask &= self.timestamps < before
+        if after is not None:
+            mask &= self.timestamps > after
+        return ImageTable(self.timestamps[mask], self.categories[mask], self.locations[mask],
+                          self.category_names, self.location_names)
+
+    @staticmethod
+    def __count_codes(codes, names):
+        # type: (np.ndarray, List[str]) -> List[Tuple[str, int]]
+        counts = np.bincount(codes, minlength=len(names))
+        order = np.argsort(-counts, kind='stable')
+        return [(names[code], int(counts[code])) for code in order if counts[code]]
+
+    def count_by_category(self):
+        # type: () -> List[Tuple[str, int]]
+        """ Return list of couples (category, number of images), sorted by decreasing count. """
+        return self.__count_codes(self.categories, self.category_names)
+
+    def count_by_location(self):
+        # type: () -> List[Tuple[str, int]]
+        """ Return list of couples (location, number of images), sorted by decreasing count. """
+        return self.__count_codes(self.locations, self.location_names)
+
+    def count_by_day(self):
+        # type: () -> List[Tuple[str, int]]
+        """ Return list of couples (day as "AAAA-MM-DD" in UTC, number of images), sorted by day. """
+        days, counts = np.unique(self.timestamps // NANOSECONDS_PER_DAY, return_counts=True)
+        dates = days.astype('datetime64[D]')
+        return [(str(date), int(count)) for date, count in zip(dates, counts)]
+
+    def histogram(self, bins=10):
+        # type: (int) -> List[Tuple[str, str, int]]
+        """ Return histogram of uploaded images over time, as a list of
+            triples (interval start, interval end, number of images).
+            Interval bounds are ISO dates in UTC.
+        """
+        if not len(self):
+            return []
+        counts, edges = np.histogram(self.timestamps, bins=bins)
+        edges = edges.astype(np.int64).astype('datetime64[ns]').astype('datetime64[s]')
+        return [(str(edges[i]), str(edges[i + 1]), int(counts[i])) for i in range(len(counts))]
+
+
+def datetime_to_nanoseconds(date):
+    # type: (datetime) -> int
+    """ Convert a datetime to timestamp in nanoseconds. Naive datetime is considered in UTC. """
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return calendar.timegm(date.timetuple()) * 1000000000 + date.microsecond * 1000
@@ -0,0 +1,129 @@
+# Standard json module is used here for its incremental decoder (JSONDecoder.raw_decode).
+import json
+import os
+from typing import IO, Iterator, List, Sequence, Tuple
+
+METADATA_FILE_NAMES = ('metadata.json', 'metadata.jsonl')
+CHUNK_SIZE = 64 * 1024
+
+
+def find_metadata_files(paths):
+    # type: (Sequence[str]) -> List[str]
+    """ Find metadata files generated by download script.
+        :param paths: list of paths. Each path is either a metadata file,
+            or a directory to recursively search for metadata files
+            (named "metadata.json" or "metadata.jsonl").
+        :return: sorted list of absolute paths of metadata files found.
+    """
+    file_names = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, base_names in os.walk(path):
+                for base_name in base_names:
+                    if base_name in METADATA_FILE_NAMES:
+                        file_names.add(os.path.abspath(os.path.join(directory, base_name)))
+        elif os.path.isfile(path):
+            file_names.add(os.path.abspath(path))
+        else:
+            raise FileNotFoundError(path)
+    return sorted(file_names)
+
+
+def _iter_json_object(file, file_name):
+    # type: (IO[str], str) -> Iterator[Tuple[str, object]]
+    """ Incrementally parse a JSON object from given file and generate its (key, value) couples.
+        File is read by chunks, so that only current value is kept in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, position, eof
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def peek():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return None
+
+    def expect(characters):
+        nonlocal position
+        character = peek()
+        if character is None or character not in characters:
+            raise RuntimeError('Invalid metadata JSON in file %s: expected one of %s, got %s'
+                               % (file_name, tuple(characters), character))
+        position += 1
+        return character
+
+    def decode():
+        nonlocal position
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # A value ending with buffer may be truncated (e.g. a number).
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError as exc:
+                if eof:
+                    raise RuntimeError('Invalid metadata JSON in file %s: %s' % (file_name, exc))
+            read_more()
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode()
+        if not isinstance(key, str):
+            raise RuntimeError('Invalid metadata JSON in file %s: expected a string key' % file_name)
+        expect(':')
+        yield key, decode()
+        if expect(',}') == '}':
+            return
+
+
+def _iter_json_line(line, file_name):
+    # type: (str, str) -> Iterator[Tuple[str, object]]
+    try:
+        entries = json.loads(line)
+    except json.JSONDecodeError as exc:
+        raise RuntimeError('Invalid metadata JSON line in file %s: %s' % (file_name, exc))
+    if not isinstance(entries, dict):
+        raise RuntimeError('Metadata line is not a dictionary in file %s' % file_name)
+    return iter(entries.items())
+
+
+def iter_metadata(file_name):
+    # type: (str) -> Iterator[Tuple[str, dict]]
+    """ Incrementally read a metadata file generated by download script.
+        :param file_name: path to metadata file, either:
+            - a JSON file containing a dictionary mapping image paths to image metadata
+            - a JSONL file with one such dictionary per line.
+        :return: a generator of couples (image path, image metadata dictionary).
+    """
+    with open(file_name, 'r') as file:
+        if file_name.endswith('.jsonl'):
+            entries = (entry
+                       for line in file if line.strip()
+                       for entry in _iter_json_line(line, file_name))
+        else:
+            entries = _iter_json_object(file, file_name)
+        for image_path, image_metadata in entries:
+            if not isinstance(image_metadata, dict):
+                raise RuntimeError('Metadata is not a dictionary for image %s in file %s'
+                                   % (image_path, file_name))
+            yield image_path, image_metadata
@@ -9,3 +9,22 @@ def images_by_category(uploads):
         for image_info in upload.images:
             categories.setdefault(image_info.category, []).append(image_info)
     return categories
+
+
+def min_resolution(min_width=None, min_height=None):
+    # type: (Optional[int], Optional[int]) -> Callable[[ImageInfo], bool]
+    """ Create an image filter to be used with `ClimatePixDatabase.download_all_images()`.
+        Images must have been probed before (see `ClimatePixDatabase.probe_images()`).
+        Images not probed are rejected.
+        :param min_width: (optional) minimum image width.
+        :param min_height: (optional) minimum image height.
+        :return: a function receiving an ImageInfo object and returning True
+            if image has at least given dimensions.
+    """
+
+    def image_filter(image_info):
+        return (image_info.width is not None
+                and (min_width is None or image_info.width >= min_width)
+                and (min_height is None or image_info.height >= min_height))
+
+    return image_filter
@@ -46,9 +46,10 @@ class Sending:
 
 
 class UploadToSend:
-    __slots__ = ('upload_id', 'timestamp', 'images')
+    __slots__ = ('collection_id', 'upload_id', 'timestamp', 'images')
 
-    def __init__(self, upload_id, timestamp, images):
+    def __init__(self, collection_id, upload_id, timestamp, images):
+        self.collection_id = collection_id
         self.upload_id = upload_id
         self.timestamp = timestamp
         self.images = images
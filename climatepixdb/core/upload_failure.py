@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 from google.api_core.datetime_helpers import DatetimeWithNanoseconds
@@ -6,13 +7,14 @@ from climatepixdb.core.image_info import ImageInfo
 
 
 class UploadFailure:
-    __slots__ = ('collection_id', 'upload_id', 'exception', 'timestamp')
+    __slots__ = ('collection_id', 'upload_id', 'exception', 'timestamp', 'create_time')
 
-    def __init__(self, collection_id, upload_id, exception, initial_data=None):
-        # type: (str, str, Exception, Optional[dict]) -> None
+    def __init__(self, collection_id, upload_id, exception, initial_data=None, create_time=None):
+        # type: (str, str, Exception, Optional[dict], Optional[datetime]) -> None
         self.collection_id = collection_id  # type: str
         self.upload_id = upload_id  # type: str
         self.exception = exception  # type: Exception
+        self.create_time = create_time  # type: Optional[datetime]
         self.timestamp = ImageInfo.UNKNOWN_CATEGORY
         if (initial_data
                 and 'timestamp' in initial_data
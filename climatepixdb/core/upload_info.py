@@ -1,4 +1,5 @@
-from typing import Dict
+from datetime import datetime
+from typing import Dict, Optional
 
 from google.api_core.datetime_helpers import DatetimeWithNanoseconds
 
@@ -11,12 +12,13 @@ class UploadInfo:
         - upload_id: ID of upload info in Firebase database.
         - images: list of ImageInfo objects representing info abouts images uploaded on this upload.
         - timestamp_nanoseconds: server timestamp in nanoseconds where this upload was done.
+        - create_time: (optional) datetime when upload document was created in database.
     """
-    __slots__ = ('collection_id', 'upload_id', 'images', 'timestamp')
+    __slots__ = ('collection_id', 'upload_id', 'images', 'timestamp', 'create_time')
     images: Dict[str, ImageInfo]
 
-    def __init__(self, collection_id, upload_id, dictionary):
-        # type: (str, str, dict) -> None
+    def __init__(self, collection_id, upload_id, dictionary, create_time=None):
+        # type: (str, str, dict, Optional[datetime]) -> None
         for field in ('timestamp', 'images'):
             if field not in dictionary:
                 raise UploadError('Upload dictionary missing field %s' % field)
@@ -34,6 +36,7 @@ class UploadInfo:
             image_info = ImageInfo(image_dictionary)
             self.images[image_info.firebase_path] = image_info
         self.timestamp = timestamp
+        self.create_time = create_time
 
     @property
     def timestamp_nanoseconds(self):
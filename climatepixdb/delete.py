@@ -1,4 +1,5 @@
 import argparse
+from datetime import timedelta
 
 from climatepixdb.core.database import ClimatePixDatabase
 from climatepixdb.download import parse_since
@@ -26,31 +27,48 @@ or run the script where the file is stored."""
                              'By default, download images from public collection.')
     parser.add_argument('--invalid', '-i', action='store_true',
                         help='Delete only invalid collection entries not associated to any image. '
-                             'NB: arguments "before", "after" and "invalid" are mutually exclusive.')
+                             'NB: arguments "before", "after", "invalid" and "orphans" '
+                             'are mutually exclusive.')
+    parser.add_argument('--orphans', '-o', action='store_true',
+                        help='Delete both invalid collection entries not associated to any image '
+                             'and images not associated to any collection entry '
+                             '(or not listed in associated entry). '
+                             'NB: arguments "before", "after", "invalid" and "orphans" '
+                             'are mutually exclusive.')
     parser.add_argument('--before', '-b', type=parse_since,
                         help='Delete images before this date. Format "AAAA-MM-DD". '
-                             'NB: arguments "before", "after" and "invalid" are mutually exclusive.')
+                             'NB: arguments "before", "after", "invalid" and "orphans" '
+                             'are mutually exclusive.')
     parser.add_argument('--after', '-a', type=parse_since,
                         help='Delete images after this date. Format "AAAA-MM-DD". '
-                             'NB: arguments "before", "after" and "invalid" are mutually exclusive.')
+                             'NB: arguments "before", "after", "invalid" and "orphans" '
+                             'are mutually exclusive.')
     parser.add_argument('--force', '-f', action='store_true',
                         help='If specified, force deletions without asking confirmation. '
                              'Used with --before or --after only.')
-    # parser.add_argument('--verbose', '-v', action='store_true',
-    #                     help='If specified, print downloading status.')
+    parser.add_argument('--dry-run', '-n', action='store_true',
+                        help='If specified, only report orphans without deleting them. '
+                             'Used with --orphans only.')
+    parser.add_argument('--min-age', '-m', type=float, default=24,
+                        help='Age in hours. Documents and images created more recently are not '
+                             'deleted, as they may belong to an upload still in progress. '
+                             'Used with --orphans only. Default 24.')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='If specified, print each orphan found. Used with --orphans only.')
     args = parser.parse_args()
     dev = args.dev
     before = args.before
     after = args.after
     invalid = args.invalid
-    nb_del_args = (before is not None) + (after is not None) + invalid
+    orphans = args.orphans
+    nb_del_args = (before is not None) + (after is not None) + invalid + orphans
     if nb_del_args != 1:
         raise ValueError('You must specify exactly one flag between '
-                         '--before, --after and --invalid.')
+                         '--before, --after, --invalid and --orphans.')
 
     print('Deleting ', end='')
-    if invalid:
-        print('invalid documents', end='')
+    if invalid or orphans:
+        print('invalid documents' if invalid else 'invalid documents and orphan images', end='')
         if dev:
             print(' from development collection', end='')
     else:
@@ -63,6 +81,13 @@ or run the script where the file is stored."""
     if invalid:
         uploads = (database.get_dev_uploads() if dev else database.get_public_uploads())
         database.delete_invalid_documents(uploads)
+    elif orphans:
+        uploads = (database.get_dev_uploads() if dev else database.get_public_uploads())
+        database.reconcile(uploads,
+                           'dev' if dev else 'public',
+                           min_age=timedelta(hours=args.min_age),
+                           dry_run=args.dry_run,
+                           verbose=args.verbose)
     else:
         uploads = (database.get_dev_uploads(before=before, after=after)
                    if dev else database.get_public_uploads(before=before, after=after))
@@ -3,6 +3,7 @@ from datetime import datetime
 from typing import Optional
 
 from climatepixdb.core.database import ClimatePixDatabase
+from climatepixdb.core.others import min_resolution
 
 
 def parse_since(value):
@@ -39,6 +40,8 @@ Output:
   that map each image file name to all metadata except category.
   JSON object is a dictionary with following format:
   <image_filename.extension>: {"location": <location>, "timestamp": <download timestamp>}
+- If images are probed, each metadata dictionary also contains
+  "format", "width", "height" and "size" (in bytes) of image.
         """
     )
     parser.add_argument('--output', '-o',
@@ -58,10 +61,22 @@ Output:
                         help='If specified, group images by category sub-folders into output folder. '
                              'Sub-folders names will be categories names. '
                              'By default, download all images directly into output folder.')
+    parser.add_argument('--probe', '-p', action='store_true',
+                        help='If specified, read image headers before downloading, to add image '
+                             'format, width, height and size into metadata.')
+    parser.add_argument('--min-width', type=int,
+                        help='If specified, download only images with at least this width. '
+                             'Implies --probe.')
+    parser.add_argument('--min-height', type=int,
+                        help='If specified, download only images with at least this height. '
+                             'Implies --probe.')
     parser.add_argument('--verbose', '-v', action='store_true',
                         help='If specified, print downloading status.')
 
     args = parser.parse_args()
+    image_filter = None
+    if args.min_width is not None or args.min_height is not None:
+        image_filter = min_resolution(args.min_width, args.min_height)
 
     download_info = (
             ('development ' if args.dev else '')
@@ -78,7 +93,10 @@ Output:
     uploads = (database.get_dev_uploads(after=args.since)
                if args.dev
                else database.get_public_uploads(after=args.since))
-    database.download_all_images(uploads, args.output, args.categorize, args.verbose)
+    if args.probe or image_filter is not None:
+        database.probe_images(uploads, verbose=args.verbose)
+    database.download_all_images(uploads, args.output, args.categorize, args.verbose,
+                                 image_filter=image_filter)
 
 
 if __name__ == '__main__':
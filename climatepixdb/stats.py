@@ -0,0 +1,94 @@
+import argparse
+import os
+
+import ujson as json
+
+from climatepixdb.core.database import ClimatePixDatabase
+from climatepixdb.core.image_table import ImageTable, datetime_to_nanoseconds
+from climatepixdb.download import parse_since
+
+
+def print_table(title, header, rows):
+    print()
+    print(title)
+    widths = [max([len(str(row[i])) for row in rows] + [len(header[i])]) for i in range(len(header))]
+    print('  '.join(name.ljust(width) for name, width in zip(header, widths)))
+    print('  '.join('-' * width for width in widths))
+    for row in rows:
+        print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='Helper script to compute statistics about ClimatePix database',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""
+This script can be used to count images per category, per location and per day,
+and to compute an histogram of uploaded images over time, without downloading images.
+
+Unless a snapshot file is loaded (--load), a credentials file named "credentials.json"
+must be present in the working directory to help the script connect to database.
+
+If you don't have this file, please contact a CCAI project member.
+
+If you have this file, either place it where you want to run the script,
+or run the script where the file is stored."""
+    )
+    parser.add_argument('--since', '-t', type=parse_since, default=None,
+                        help='Date to count images uploaded only since that day. '
+                             'Either a date in format "AAAA-MM-DD", or "all" to count all uploaded images. '
+                             'Default is "all".')
+    parser.add_argument('--dev', '-d', action='store_true',
+                        help='If specified, count images from development collection. '
+                             'By default, count images from public collection.')
+    parser.add_argument('--load', '-l', type=str,
+                        help='If specified, load images info from this snapshot file '
+                             'instead of database. NB: --dev is then ignored.')
+    parser.add_argument('--save', '-s', type=str,
+                        help='If specified, save images info retrieved from database '
+                             'into this snapshot file, to be used later with --load.')
+    parser.add_argument('--bins', '-b', type=int, default=10,
+                        help='Number of intervals in histogram of uploaded images over time. Default 10.')
+    parser.add_argument('--json', '-j', action='store_true',
+                        help='If specified, print statistics as a JSON object.')
+    args = parser.parse_args()
+
+    if args.load:
+        if not os.path.isfile(args.load):
+            raise FileNotFoundError(args.load)
+        table = ImageTable.load(args.load)
+        if args.since is not None:
+            table = table.select(after=datetime_to_nanoseconds(args.since))
+    else:
+        database = ClimatePixDatabase()
+        table = database.get_image_table(dev=args.dev, after=args.since)
+        if args.save:
+            table.save(args.save)
+
+    by_category = table.count_by_category()
+    by_location = table.count_by_location()
+    by_day = table.count_by_day()
+    histogram = table.histogram(args.bins)
+
+    if args.json:
+        print(json.dumps({
+            'nb_images': len(table),
+            'categories': dict(by_category),
+            'locations': dict(by_location),
+            'days': dict(by_day),
+            'histogram': [{'start': start, 'end': end, 'count': count}
+                          for start, end, count in histogram]
+        }, indent=1))
+    else:
+        print('NB IMAGES', len(table))
+        print_table('IMAGES PER CATEGORY', ('category', 'count'), by_category)
+        print_table('IMAGES PER LOCATION', ('location', 'count'), by_location)
+        print_table('IMAGES PER DAY', ('day', 'count'), by_day)
+        print_table('IMAGES OVER TIME', ('start', 'end', 'count'), histogram)
+    if args.save and not args.load and not args.json:
+        print()
+        print('SNAPSHOT SAVED', args.save)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,13 +19,17 @@ def main():
     If you have this file, either place it where you want to run the script,
     or run the script where the file is stored."""
     )
-    parser.add_argument('metadata', type=str,
-                        help='Path to a JSON file generated by download script '
-                             '`climatepixdb.download`. Data in JSON will be used to locate images, '
+    parser.add_argument('metadata', type=str, nargs='+',
+                        help='Paths to JSON (or JSONL) files generated by download script '
+                             '`climatepixdb.download`, or to folders to recursively search for '
+                             'such files named "metadata.json" (or "metadata.jsonl"). '
+                             'Data in metadata files will be used to locate images, '
                              'associate metadata, and create corresponding entries in database.')
+    parser.add_argument('--workers', '-w', type=int, default=4,
+                        help='Number of uploads sent concurrently. Default 4.')
     args = parser.parse_args()
     database = ClimatePixDatabase()
-    database.upload(args.metadata)
+    database.upload(args.metadata, max_workers=args.workers)
 
 
 if __name__ == '__main__':
@@ -6,6 +6,7 @@ setup(
     packages=['climatepixdb', 'climatepixdb.core'],
     install_requires=[
         'firebase-admin',
+        'numpy',
         'ujson'
     ],
     url='',